@@ -1,18 +1,24 @@
 # -*- coding: utf-8 -*-
-import requests
-import xml.etree.ElementTree as ET
-from bs4 import BeautifulSoup
-from thefuzz import fuzz
+# requests, lxml.html, rapidfuzz, numpy and coloredlogs are imported by the functions that use them, so --help/--version start fast
+from lxml import etree as ET
 import sys
 import os
+import pathlib
 import re
 import argparse
 import csv
 import urllib.parse
 import datetime
 import string
+import hashlib
+import json
+import functools
 import logging
-import coloredlogs
+from logging.handlers import QueueHandler, QueueListener
+import queue
+import atexit
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from colorama import Fore, Style, init # Re-imported for interactive prompt
 from tqdm import tqdm
 
@@ -26,69 +32,232 @@ SCRIPT_HOMEPAGE = "https://github.com/f3rs3n/VREC-dat-filter"
 
 # --- Constants ---
 INTERACTIVE_LOW_THRESHOLD = 51
+MAX_FETCH_WORKERS = 16
+CSV_BUFFER_SIZE = 1024 * 1024 # Large enough that a whole unmatched-titles report goes out in one write
+DAT_OUTPUT_BUFFER_SIZE = 64 * 1024
+LOG_FILE_BUFFER_SIZE = 64 * 1024
+SCORE_BLOCK_ROWS = 2048 # Distinct DAT titles scored per cdist block; caps the temporary matrix next to the full score matrix
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'vrec-dat-filter') # Parsed titles per URL, revalidated with conditional GETs
+TITLE_CACHE_FORMAT = 2 # Bump whenever clean_title_for_comparison/clean_titles_for_comparison output or the cache entry layout changes
+TITLE_CACHE_SIZE = 65536 # Memoized titles; the same names recur across wiki pages and DAT regions/revisions
+REQUEST_HEADERS = { 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36' }
+FETCH_TIMEOUT = (5, 30) # (connect, read) seconds: an unreachable host fails fast, a slow wiki page still gets time
+FETCH_RETRY_OPTIONS = {'total': 3, 'backoff_factor': 0.3, 'status_forcelist': (429, 500, 502, 503, 504), 'allowed_methods': frozenset(['GET']), 'raise_on_status': False} # Transient failures only; 404s still surface immediately
+
+# Characters thefuzz's force_ascii dropped before scoring; kept so scores match the original thefuzz results
+ASCII_ONLY_TRANSLATION = {i: None for i in range(128, 256)}
+
+# Header children carried over from the input DAT; the ones the script writes itself are never copied
+HEADER_TAGS_SET_BY_SCRIPT = frozenset(['name', 'description', 'version', 'date', 'author', 'homepage'])
+HEADER_TAGS_TO_COPY = frozenset(['version', 'date', 'author', 'homepage', 'url', 'retool', 'clrmamepro', 'comment']) - HEADER_TAGS_SET_BY_SCRIPT
 
 # --- Pre-compiled Regex Patterns ---
-is_disc_1_regex = re.compile(r'\((?:Disc|Disk|Side|Tape)\s+1\)', flags=re.IGNORECASE)
-is_disc_n_regex = re.compile(r'\((?:Disc|Disk|Side|Tape)\s+\d+\)', flags=re.IGNORECASE)
+disc_tag_regex = re.compile(r'^(?P<base>.*?)\s*\((?:Disc|Disk|Side|Tape)\s+(?P<num>\d+)\)\s*$', flags=re.IGNORECASE | re.DOTALL)
+bracketed_tag_regex = re.compile(r'\s*(?:\[[^]]*\]|\([^)]*\))') # [..] and (..) tags dropped in one pass
+footnote_regex = re.compile(r'\[.*?\]')
+trailing_parentheses_regex = re.compile(r'\s*\([^)]*\)$') # Last (...) tag of the input header name
+unsafe_filename_chars_regex = re.compile(r'[^\w.-]+')
+url_variant_suffix_regex = re.compile(r'/(homebrew|japan)$', flags=re.IGNORECASE)
+# Bulk variants: same patterns, but never crossing the NUL that separates titles (NUL cannot occur in XML text)
+bulk_bracketed_tag_regex = re.compile(r'\s*(?:\[[^]\0]*\]|\([^)\0]*\))')
+
+# --- XPath Queries (wiki pages) ---
+# Compiled once here; element.xpath() would recompile the expression on every row
+WIKITABLE_XPATH = ET.XPath("//table[contains(concat(' ', normalize-space(@class), ' '), ' wikitable ')]")
+DATA_ROWS_XPATH = ET.XPath("(.//tr)[position() > 1]") # All rows of a table except its first (header) row
+TITLE_CELL_TEXT_XPATH = ET.XPath("(.//*[self::td or self::th])[2]//text()") # Text nodes of a row's second cell (the title column)
+# Strips all punctuation except '-', which clean_title_for_comparison turns into a space
+punctuation_translator = str.maketrans('-', ' ', ''.join(p for p in string.punctuation if p != '-')) # Drop punctuation, turn hyphens into spaces
 
 # --- Helper Functions ---
+class BufferedFileHandler(logging.FileHandler):
+    """FileHandler writing through a 64KB buffer: the stream is flushed for ERROR and above and on close, not after every record."""
+    def _open(self): return open(self.baseFilename, self.mode, buffering=LOG_FILE_BUFFER_SIZE, encoding=self.encoding, errors=self.errors)
+    def flush(self): pass # StreamHandler.emit flushes after each record; the buffer decides instead
+    def emit(self, record):
+        super().emit(record)
+        if record.levelno >= logging.ERROR: logging.StreamHandler.flush(self)
+
+def iter_dat_games(dat_path, tags='game'):
+    """Streams matching elements from a DAT file, freeing each processed <game> so memory stays flat."""
+    context = ET.iterparse(dat_path, events=('end',), tag=tags, huge_tree=True, remove_blank_text=True, collect_ids=False) # Nothing looks up elements by XML ID, so libxml2 needn't build an ID table
+    for _, element in context:
+        yield element
+        if element.tag == 'game':
+            element.clear()
+            while element.getprevious() is not None: del element.getparent()[0]
+
+@functools.lru_cache(maxsize=TITLE_CACHE_SIZE)
 def clean_title_for_comparison(title):
     """Applies aggressive cleaning to improve fuzzy matching."""
     if not title: return ""
-    text = title.lower(); text = re.sub(r'\s*\[[^]]*\]', '', text); text = re.sub(r'\s*\([^)]*\)', '', text)
-    translator = str.maketrans('', '', ''.join(p for p in string.punctuation if p not in ['-']))
-    text = text.translate(translator); text = text.replace('-', ' '); text = re.sub(r'\s+', ' ', text).strip()
-    return text
+    text = bracketed_tag_regex.sub('', title.lower()).translate(punctuation_translator)
+    text = ' '.join(text.split()) # Collapses and strips whitespace without another regex pass
+    return sys.intern(text) # Same title from several pages/DAT clones -> one shared string object
+
+def clean_titles_for_comparison(titles):
+    """Bulk clean_title_for_comparison: runs each cleaning step once over all titles joined by NUL instead of once per title."""
+    text = bulk_bracketed_tag_regex.sub('', '\0'.join(title or '' for title in titles).lower()).translate(punctuation_translator)
+    return [sys.intern(' '.join(cleaned_title.split())) for cleaned_title in text.split('\0')] if titles else []
+
+def prepare_for_scoring(cleaned_title):
+    """Applies thefuzz's default processing once per title so RapidFuzz scorers can run with processor=None."""
+    from rapidfuzz import utils
+    return utils.default_process(cleaned_title.translate(ASCII_ONLY_TRANSLATION))
 
-def get_name_without_disc_info(original_name):
-    """Removes disc information like (Disc N), (Disk N), etc. for multi-disc comparison."""
-    if not original_name: return ""
-    base = re.sub(r'\s*\((?:Disc|Disk|Side|Tape)\s+\d+\)\s*$', '', original_name, flags=re.IGNORECASE).strip()
-    return base
+def sort_tokens(scoring_title):
+    """Returns the title's tokens in sorted order; fuzz.ratio on two such strings equals fuzz.token_sort_ratio."""
+    return ' '.join(sorted(scoring_title.split()))
+
+@functools.lru_cache(maxsize=TITLE_CACHE_SIZE)
+def parse_disc(original_name):
+    """Splits a trailing (Disc N), (Disk N), etc. tag off a name. Returns (base_name, disc_number), disc_number is None if untagged."""
+    if not original_name: return "", None
+    disc_match = disc_tag_regex.match(original_name)
+    if not disc_match: return original_name, None
+    return disc_match.group('base').strip(), int(disc_match.group('num'))
+
+# --- Matching Functions ---
+def wratio_length_ratio_limit(score_cutoff):
+    """Returns (max length ratio, whether that ratio itself can still pass) for WRatio at score_cutoff, or None if length can't rule a pair out.
+    WRatio caps at 90 once the longer title is >= 1.5x the shorter one, and at 60 once it is > 8x."""
+    if score_cutoff > 90: return 1.5, False
+    if score_cutoff > 60: return 8.0, True
+    return None
+
+def compute_wratio_matrix(dat_titles, web_titles, score_cutoff):
+    """Scores every DAT title against every web title with WRatio, returning a uint8 matrix (rows=DAT, cols=web) that is 0 below score_cutoff."""
+    from rapidfuzz import fuzz, process; import numpy as np
+    raw_cutoff = max(0, score_cutoff - 0.5) # uint8 scores are rounded like thefuzz's integers, so a raw 89.5 still counts as 90
+    length_limit = wratio_length_ratio_limit(raw_cutoff)
+    if length_limit is None or not dat_titles or not web_titles:
+        return process.cdist(dat_titles, web_titles, scorer=fuzz.WRatio, score_cutoff=raw_cutoff, dtype=np.uint8, workers=-1)
+    # Only pairs whose length ratio stays within the limit can pass, so each DAT length is scored against a window of web titles
+    ratio_limit, limit_inclusive = length_limit; low_side, high_side = ('left', 'right') if limit_inclusive else ('right', 'left')
+    scores = np.zeros((len(dat_titles), len(web_titles)), dtype=np.uint8)
+    web_lengths = np.array([len(title) for title in web_titles]); web_order = np.argsort(web_lengths, kind='stable'); sorted_web_lengths = web_lengths[web_order]
+    rows_by_length = {}
+    for row, title in enumerate(dat_titles): rows_by_length.setdefault(len(title), []).append(row)
+    for length, rows in rows_by_length.items():
+        low = np.searchsorted(sorted_web_lengths, length / ratio_limit, side=low_side); high = np.searchsorted(sorted_web_lengths, length * ratio_limit, side=high_side)
+        if low >= high: continue
+        cols = web_order[low:high]
+        scores[np.ix_(rows, cols)] = process.cdist([dat_titles[row] for row in rows], [web_titles[col] for col in cols], scorer=fuzz.WRatio, score_cutoff=raw_cutoff, dtype=np.uint8, workers=-1)
+    return scores
 
 # --- Web Scraping Functions ---
-def fetch_single_url_titles(url):
-    """Downloads a single web page and extracts recommended game titles from wikitables."""
-    headers = { 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36' }
+_thread_local = threading.local(); _http_sessions = [] # Every worker's session, so they can be closed once scraping is done
+
+def get_http_session():
+    """Returns the calling thread's requests.Session, so each fetch worker reuses its own kept-alive connections and retries transient errors."""
+    session = getattr(_thread_local, 'session', None)
+    if session is None:
+        import requests; from requests.adapters import HTTPAdapter; from urllib3.util.retry import Retry
+        session = requests.Session(); session.headers.update(REQUEST_HEADERS)
+        adapter = HTTPAdapter(max_retries=Retry(**FETCH_RETRY_OPTIONS)); session.mount('https://', adapter); session.mount('http://', adapter)
+        _thread_local.session = session; _http_sessions.append(session)
+    return session
+
+def close_http_sessions():
+    """Closes the fetch workers' sessions and their pooled keep-alive connections."""
+    while _http_sessions: _http_sessions.pop().close()
+
+def get_cache_path(cache_dir, url):
+    """Returns the cache file for a URL (named by the URL's SHA-256, so any URL maps to a safe file name)."""
+    return os.path.join(cache_dir, hashlib.sha256(url.encode('utf-8')).hexdigest() + '.json')
+
+def load_cached_titles(cache_dir, url):
+    """Returns the cache entry (etag, last_modified, titles) stored for a URL under the current TITLE_CACHE_FORMAT, or None."""
+    try:
+        with open(get_cache_path(cache_dir, url), 'r', encoding='utf-8') as cache_file: cache_entry = json.load(cache_file)
+    except FileNotFoundError: return None
+    except (OSError, ValueError) as e: logging.warning(f"Ignoring unreadable cache entry for {url}: {e}"); return None
+    # Titles are stored already cleaned, so entries written under other cleaning rules (another TITLE_CACHE_FORMAT) are not reused
+    if cache_entry.get('url') != url or cache_entry.get('format') != TITLE_CACHE_FORMAT: return None
+    return cache_entry
+
+def get_content_hash(content):
+    """Returns the BLAKE2b digest of a page body, used to spot unchanged pages the server re-sent in full."""
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+def save_cached_titles(cache_dir, url, response, titles, content_hash):
+    """Stores the titles parsed from a response together with its validators (ETag/Last-Modified) for later conditional GETs."""
+    cache_entry = {'url': url, 'format': TITLE_CACHE_FORMAT, 'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified'), 'content_hash': content_hash, 'titles': sorted(titles)}
+    try:
+        os.makedirs(cache_dir, exist_ok=True); cache_path = get_cache_path(cache_dir, url); temp_path = f"{cache_path}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as cache_file: json.dump(cache_entry, cache_file, ensure_ascii=False)
+        os.replace(temp_path, cache_path); logging.debug("Cached %d titles for %s in %s", len(titles), url, cache_path)
+    except OSError as e: logging.warning(f"Could not write cache entry for {url}: {e}")
+
+def stale_cached_titles(cache_entry, url):
+    """Falls back to the cached titles of a URL that could not be fetched, if there are any."""
+    if cache_entry is None: return None
+    logging.warning(f"Using {len(cache_entry['titles'])} cached titles from the last successful fetch of {url}."); return set(map(sys.intern, cache_entry['titles']))
+
+def fetch_single_url_titles(url, cache_dir=None, refresh_cache=False):
+    """Downloads a single web page and extracts recommended game titles from wikitables.
+    With a cache_dir, known pages are revalidated with a conditional GET and their cached titles reused when unchanged (or when the fetch fails)."""
+    import requests; import lxml.html
+    cache_entry = load_cached_titles(cache_dir, url) if cache_dir and not refresh_cache else None; conditional_headers = {}
+    if cache_entry is not None:
+        if cache_entry.get('etag'): conditional_headers['If-None-Match'] = cache_entry['etag']
+        if cache_entry.get('last_modified'): conditional_headers['If-Modified-Since'] = cache_entry['last_modified']
     try:
-        logging.debug(f"Attempting to fetch URL: {url}"); response = requests.get(url, headers=headers, timeout=30); response.raise_for_status()
+        logging.debug("Attempting to fetch URL: %s", url); response = get_http_session().get(url, headers=conditional_headers, timeout=FETCH_TIMEOUT); response.raise_for_status()
     except requests.exceptions.HTTPError as http_err:
         if http_err.response.status_code == 404: logging.warning(f"URL not found (404), skipping: {url}"); return None
-        else: logging.error(f"HTTP Error {http_err.response.status_code} fetching {url}: {http_err}"); return None
-    except requests.exceptions.RequestException as e: logging.error(f"Network/Request Error fetching {url}: {e}"); return None
+        else: logging.error(f"HTTP Error {http_err.response.status_code} fetching {url}: {http_err}"); return stale_cached_titles(cache_entry, url)
+    except requests.exceptions.RequestException as e: logging.error(f"Network/Request Error fetching {url}: {e}"); return stale_cached_titles(cache_entry, url)
     except Exception as e: logging.exception(f"Unexpected error during fetch for {url}:"); return None
+    if response.status_code == 304 and cache_entry is not None:
+        logging.info(f"Not modified since last fetch, using {len(cache_entry['titles'])} cached titles for: {url}"); return set(map(sys.intern, cache_entry['titles']))
+    content_hash = get_content_hash(response.content)
+    if cache_entry is not None and cache_entry.get('content_hash') == content_hash: # Full response, but the same page: skip parsing, refresh the validators
+        logging.info(f"Page unchanged since last fetch, using {len(cache_entry['titles'])} cached titles for: {url}"); titles = set(map(sys.intern, cache_entry['titles']))
+        save_cached_titles(cache_dir, url, response, titles, content_hash); return titles
     logging.info(f"Processing successful fetch from: {url}")
     try:
-        soup = BeautifulSoup(response.content, 'lxml'); titles = set(); tables = soup.find_all('table', class_='wikitable')
+        # lxml gets the raw bytes: it refuses str input that still carries an <?xml ... encoding=...?> declaration
+        try: response.content.decode('utf-8'); html_parser = lxml.html.HTMLParser(encoding='utf-8') # Most wikis serve UTF-8
+        except UnicodeDecodeError: html_parser = None # Otherwise let lxml sniff <meta charset>
+        document = lxml.html.fromstring(response.content, parser=html_parser); titles = set(); tables = WIKITABLE_XPATH(document); debug_logging = logging.getLogger().isEnabledFor(logging.DEBUG)
         if not tables: logging.warning(f"No 'wikitable' table found on {url}.")
         else:
-            table_index = 0
-            for table in tables:
-                table_index += 1; logging.debug(f"Processing table {table_index} on {url}"); rows = table.find_all('tr')
-                for i, row in enumerate(rows[1:]):
-                    row_num = i + 2
+            for table_index, table in enumerate(tables, start=1):
+                logging.debug("Processing table %d on %s", table_index, url)
+                for row_num, row in enumerate(DATA_ROWS_XPATH(table), start=2):
                     try:
-                        cells = row.find_all(['td', 'th'])
-                        if len(cells) > 1:
-                            title_text_raw = cells[1].get_text(strip=True); cleaned_title_block = re.sub(r'\[.*?\]', '', title_text_raw).strip()
+                        title_cell_texts = TITLE_CELL_TEXT_XPATH(row) # Empty for rows without a second cell
+                        if title_cell_texts:
+                            title_text_raw = ''.join(text.strip() for text in title_cell_texts); cleaned_title_block = footnote_regex.sub('', title_text_raw).strip()
                             title_lines = [line.strip() for line in cleaned_title_block.split('\n') if line.strip()]
                             if title_lines:
                                 for raw_line_title in title_lines:
                                     cleaned_for_match = clean_title_for_comparison(raw_line_title)
-                                    if cleaned_for_match: logging.debug(f" Found raw='{raw_line_title}', cleaned='{cleaned_for_match}'..."); titles.add(cleaned_for_match)
+                                    if not cleaned_for_match: continue
+                                    if debug_logging: logging.debug(f" Found raw='{raw_line_title}', cleaned='{cleaned_for_match}'...")
+                                    titles.add(cleaned_for_match)
                     except Exception as row_error: logging.error(f"Error parsing row {row_num} in table {table_index} of URL {url}: {row_error}")
             logging.info(f"Found {len(titles)} unique cleaned titles on {url}.")
+        if cache_dir: save_cached_titles(cache_dir, url, response, titles, content_hash)
         return titles
     except Exception as e: logging.exception(f"Error during HTML parsing of URL {url}:"); return None
 
-def fetch_all_titles(url_list):
-    """Downloads and combines titles from a list of URLs, tracking source."""
-    all_recommended_titles = set(); titles_by_url = {}; processed_urls = set()
+def fetch_all_titles(url_list, max_workers=MAX_FETCH_WORKERS, cache_dir=None, refresh_cache=False):
+    """Downloads (concurrently, up to max_workers at once) and combines titles from a list of URLs, tracking source."""
+    all_recommended_titles = set(); titles_by_url = {}
     if not url_list: logging.error("No URLs provided for fetching."); return set(), {}
     logging.info("--- Starting Web Scrape ---")
-    for url in tqdm(url_list, desc="Scanning URLs", unit="URL", ncols=100, leave=False):
-        if url in processed_urls: logging.debug(f"Skipping already processed URL: {url}"); continue
-        titles_from_url = fetch_single_url_titles(url); processed_urls.add(url)
+    unique_urls = list(dict.fromkeys(url_list))
+    if len(unique_urls) < len(url_list): logging.debug(f"Skipping {len(url_list) - len(unique_urls)} duplicate URL(s).")
+    fetched_titles = {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(unique_urls))) as executor:
+        futures = {executor.submit(fetch_single_url_titles, url, cache_dir, refresh_cache): url for url in unique_urls}
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Scanning URLs", unit="URL", ncols=100, leave=False):
+            fetched_titles[futures[future]] = future.result()
+    close_http_sessions()
+    for url in unique_urls: # Merge in the original URL order so reports stay deterministic
+        titles_from_url = fetched_titles[url]
         if titles_from_url is not None:
             titles_by_url[url] = titles_from_url
             if titles_from_url: all_recommended_titles.update(titles_from_url)
@@ -104,41 +273,49 @@ def filter_dat_file(input_dat_path, output_dat_path, all_recommended_titles, tit
     """Filters the DAT file based on best match per web title (using WRatio+TokenSortRatio tie-breaker), generates reports, updates header. Includes optional interactive review with recalculated scores and TokenSortRatio filter."""
     if not os.path.exists(input_dat_path): logging.critical(f"Input file '{input_dat_path}' does not exist."); return False
     if all_recommended_titles is None: logging.critical("Cannot proceed, error fetching recommended titles."); return False
+    from rapidfuzz import fuzz, process; import numpy as np
+    debug_logging = logging.getLogger().isEnabledFor(logging.DEBUG) # Per-match debug messages are only formatted when some handler wants them
     if not all_recommended_titles: logging.warning("No valid web titles found for comparison...");
     logging.info(f"Reading and parsing DAT file: {input_dat_path}")
+    logging.info("--- Pre-cleaning DAT Titles ---")
+    # Parallel per-game lists (struct-of-arrays) indexed by game index, in DAT order
+    original_names = []
+    original_header_element = None; root = None; input_doctype = None
     try:
-        tree = ET.parse(input_dat_path); root = tree.getroot()
+        for element in tqdm(iter_dat_games(input_dat_path, tags=('header', 'game')), desc="Cleaning DAT Titles", unit="game", ncols=100, leave=False):
+            if root is None:
+                root_tree = element.getroottree(); root = root_tree.getroot(); input_doctype = root_tree.docinfo.doctype # e.g. the Logiqx DTD declaration, carried over to the output
+                if root.tag != 'datafile': break
+            if element.tag == 'header':
+                if original_header_element is None and element.getparent() is root: original_header_element = element
+                continue
+            original_names.append(element.get('name'))
+        if root is None: # No <header>/<game> at all (collect_ids=False is left out here: with it, ET.parse tries to fetch an external DTD)
+            root_tree = ET.parse(input_dat_path, parser=ET.XMLParser(huge_tree=True)); root = root_tree.getroot(); input_doctype = root_tree.docinfo.doctype
         if root.tag != 'datafile': logging.critical(f"Input DAT file '{input_dat_path}' has wrong root '<{root.tag}>'. Aborting."); return False
         logging.debug(f"Successfully parsed DAT file. Root element is '<{root.tag}>'.")
     except ET.ParseError as parse_err: logging.critical(f"Error parsing DAT file '{input_dat_path}': {parse_err}"); return False
     except Exception as e: logging.exception(f"Unexpected error during DAT file reading/parsing:"); return False
-
-    logging.info("--- Pre-cleaning DAT Titles ---")
-    cleaned_dat_titles_map = {}
-    all_game_elements = root.findall('.//game'); original_game_count = len(all_game_elements)
-    for game_element in tqdm(all_game_elements, desc="Cleaning DAT Titles", unit="game", ncols=100, leave=False):
-        original_name = game_element.get('name')
-        if original_name:
-            cleaned_title = clean_title_for_comparison(original_name)
-            if cleaned_title: cleaned_dat_titles_map[game_element] = cleaned_title
-    logging.info(f"Pre-cleaned {len(cleaned_dat_titles_map)} non-empty DAT titles.")
+    original_game_count = len(original_names); cleaned_dat_titles = clean_titles_for_comparison(original_names)
+    dat_rows = [game_index for game_index, cleaned_dat_title in enumerate(cleaned_dat_titles) if cleaned_dat_title] # Games taking part in matching
+    logging.info(f"Pre-cleaned {len(dat_rows)} non-empty DAT titles.")
 
     logging.info("--- Processing Header ---")
-    original_header_element = root.find('header'); new_header = ET.Element('header'); today_date = datetime.date.today().strftime('%Y-%m-%d')
+    new_header = ET.Element('header'); today_date = datetime.date.today().strftime('%Y-%m-%d')
     original_name_text = "Unknown System"; original_description_text = "Unknown DAT"; elements_to_copy = []
     if original_header_element is not None:
         logging.debug("Found existing <header> element.")
-        name_el = original_header_element.find('name'); desc_el = original_header_element.find('description')
+        first_header_child = {} # Single pass over the header; the first <name>/<description> wins, as with find()
+        for child in original_header_element:
+            first_header_child.setdefault(child.tag, child)
+            if child.tag in HEADER_TAGS_TO_COPY:
+                 logging.debug(" Copying header tag: <%s>", child.tag); elements_to_copy.append({'tag': child.tag, 'text': child.text, 'attrib': child.attrib})
+        name_el = first_header_child.get('name'); desc_el = first_header_child.get('description')
         if name_el is not None and name_el.text: original_name_text = name_el.text.strip()
         if desc_el is not None and desc_el.text: original_description_text = desc_el.text.strip()
         logging.debug(f" Original Name: '{original_name_text}', Original Description: '{original_description_text}'")
-        tags_to_copy = ['version', 'date', 'author', 'homepage', 'url', 'retool', 'clrmamepro', 'comment']
-        manual_tags = ['name', 'description', 'version', 'date', 'author', 'homepage']
-        for child in original_header_element:
-            if child.tag in tags_to_copy and child.tag not in manual_tags:
-                 logging.debug(f" Copying header tag: <{child.tag}>"); elements_to_copy.append({'tag': child.tag, 'text': child.text, 'attrib': child.attrib})
     else: logging.warning("No <header> element found in input DAT.")
-    processed_name = re.sub(r'\s*\([^)]*\)$', '', original_name_text).strip()
+    processed_name = trailing_parentheses_regex.sub('', original_name_text).strip()
     ET.SubElement(new_header, 'name').text = f"{processed_name} (VREC DAT Filter)"; ET.SubElement(new_header, 'description').text = f"{original_description_text} (VREC DAT Filter)"
     ET.SubElement(new_header, 'version').text = SCRIPT_VERSION; ET.SubElement(new_header, 'date').text = today_date
     ET.SubElement(new_header, 'author').text = SCRIPT_AUTHOR; ET.SubElement(new_header, 'homepage').text = SCRIPT_HOMEPAGE
@@ -149,90 +326,117 @@ def filter_dat_file(input_dat_path, output_dat_path, all_recommended_titles, tit
     logging.info(f"Finding potential matches >= {similarity_threshold}% (Algorithm: WRatio + TokenSortRatio)...")
     matches_per_web_title = {}
     if original_game_count == 0: logging.warning("No <game> elements found in the input DAT file.")
-    game_iterator_stage1 = tqdm(all_game_elements, desc="Finding Matches", unit=" game", ncols=100, leave=False, bar_format='{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}, {rate_fmt}]')
-    for game_element in game_iterator_stage1:
-        cleaned_dat_title = cleaned_dat_titles_map.get(game_element)
-        if not cleaned_dat_title: continue
-        dat_title_original = game_element.get('name')
-        for recommended_title in all_recommended_titles:
-            try:
-                wratio_similarity = fuzz.WRatio(cleaned_dat_title, recommended_title)
-                if wratio_similarity >= similarity_threshold:
-                    tokensort_similarity = fuzz.token_sort_ratio(cleaned_dat_title, recommended_title)
-                    logging.debug(f"  Storing HIGH potential match for Web '{recommended_title}': DAT '{dat_title_original}' (WR: {wratio_similarity}%, TSR: {tokensort_similarity}%)")
-                    match_info = (wratio_similarity, tokensort_similarity, game_element)
-                    matches_per_web_title.setdefault(recommended_title, []).append(match_info)
-            except Exception as fuzz_error: logging.error(f"Error during fuzzy comparison between DAT:'{cleaned_dat_title}' and WEB:'{recommended_title}': {fuzz_error}")
+    # Clones/regions share a cleaned title, so the scoring forms are built once per distinct title and looked up per game
+    scoring_form_of = {cleaned_dat_title: prepare_for_scoring(cleaned_dat_title) for cleaned_dat_title in dict.fromkeys(cleaned_dat_titles)}
+    token_sorted_form_of = {scoring_title: sort_tokens(scoring_title) for scoring_title in dict.fromkeys(scoring_form_of.values())}
+    scoring_dat_titles = [scoring_form_of[cleaned_dat_title] for cleaned_dat_title in cleaned_dat_titles]
+    web_title_list = sorted(all_recommended_titles); scoring_web_titles = [prepare_for_scoring(title) for title in web_title_list]
+    # Token-sorted forms are built once here instead of inside every token_sort_ratio call (Stage 1 and Stage 3)
+    token_sorted_dat_titles = [token_sorted_form_of[title] for title in scoring_dat_titles]; token_sorted_web_titles = [sort_tokens(title) for title in scoring_web_titles]
+    # With interactive review the cutoff is lowered so Stage 3 can reuse this matrix instead of rescoring discarded games.
+    score_cutoff = min(similarity_threshold, INTERACTIVE_LOW_THRESHOLD) if args.interactive_review else similarity_threshold
+    # Regional variants/revisions often clean to the same title, so only distinct titles are scored (rows of unique_scores)
+    unique_scoring_titles, unique_index_of_row = np.unique(np.array([scoring_dat_titles[i] for i in dat_rows], dtype=str), return_inverse=True)
+    # A web title equal to a DAT title scores 100 there, and only an identical title can: that row (with its clones and sibling discs)
+    # wins Stage 2 outright and the title never reaches review, so its column needs no fuzzy scoring.
+    unique_scoring_title_list = unique_scoring_titles.tolist(); unique_row_of_title = {title: unique_row for unique_row, title in enumerate(unique_scoring_title_list)}
+    exact_unique_rows = [unique_row_of_title.get(title) if title else None for title in scoring_web_titles]
+    fuzzy_cols = [col for col, unique_row in enumerate(exact_unique_rows) if unique_row is None]
+    unique_scores = np.zeros((len(unique_scoring_titles), len(scoring_web_titles)), dtype=np.uint8)
+    fuzzy_web_titles = [scoring_web_titles[col] for col in fuzzy_cols]
+    for block_start in range(0, len(unique_scoring_title_list) if fuzzy_cols else 0, SCORE_BLOCK_ROWS): # Row blocks, so no second full-size matrix is built
+        block = slice(block_start, block_start + SCORE_BLOCK_ROWS)
+        unique_scores[block, fuzzy_cols] = compute_wratio_matrix(unique_scoring_title_list[block], fuzzy_web_titles, score_cutoff)
+    for col, unique_row in enumerate(exact_unique_rows):
+        if unique_row is not None: unique_scores[unique_row, col] = 100
+    logging.debug(f"{len(exact_unique_rows) - exact_unique_rows.count(None)} web titles matched a DAT title exactly; fuzzy-scored {len(fuzzy_cols)} web titles.")
+    logging.debug(f"Scored {len(unique_scoring_titles)} distinct cleaned DAT titles for {len(dat_rows)} games.")
+    unique_hit_mask = unique_scores >= similarity_threshold
+    if args.fast_match and unique_scores.shape[1]: # --fast-match: each game only counts for its best web title
+        # Exact-match columns hold 0 outside their own row, so rows with a hit get real scores against those titles before choosing;
+        # ties go to the higher TokenSortRatio, then the alphabetically first web title (web_title_list is sorted)
+        hit_unique_rows = np.flatnonzero(unique_hit_mask.any(axis=1)); exact_cols = [col for col, unique_row in enumerate(exact_unique_rows) if unique_row is not None]
+        hit_row_scores = unique_scores[hit_unique_rows]
+        if exact_cols and len(hit_unique_rows): hit_row_scores[:, exact_cols] = compute_wratio_matrix([unique_scoring_title_list[unique_row] for unique_row in hit_unique_rows], [scoring_web_titles[col] for col in exact_cols], similarity_threshold)
+        best_cols_of_unique_row = {} # Empty when the best title is an exact match of another DAT title, which that title's own row always wins
+        for unique_row, row_scores in zip(hit_unique_rows.tolist(), hit_row_scores):
+            tied_cols = np.flatnonzero(row_scores == row_scores.max()).tolist(); token_sorted_dat_title = token_sorted_form_of[unique_scoring_title_list[unique_row]]
+            best_col = tied_cols[0] if len(tied_cols) == 1 else max(tied_cols, key=lambda col: (round(fuzz.ratio(token_sorted_dat_title, token_sorted_web_titles[col])), -col))
+            best_cols_of_unique_row[unique_row] = (best_col,) if unique_hit_mask[unique_row, best_col] else ()
+    for row in np.flatnonzero(unique_hit_mask.any(axis=1)[unique_index_of_row]): # Rows in DAT order, as ties are broken by insertion order
+        unique_row = unique_index_of_row[row]; game_index = dat_rows[row]
+        for col in (best_cols_of_unique_row[unique_row] if args.fast_match else np.flatnonzero(unique_hit_mask[unique_row])):
+            recommended_title = web_title_list[col]
+            wratio_similarity = int(unique_scores[unique_row, col]); tokensort_similarity = round(fuzz.ratio(token_sorted_dat_titles[game_index], token_sorted_web_titles[col]))
+            if debug_logging: logging.debug(f"  Storing HIGH potential match for Web '{recommended_title}': DAT '{original_names[game_index]}' (WR: {wratio_similarity}%, TSR: {tokensort_similarity}%)")
+            match_info = (wratio_similarity, tokensort_similarity, game_index)
+            matches_per_web_title.setdefault(col, []).append(match_info)
     logging.info(f"Found high-scoring potential matches for {len(matches_per_web_title)} unique web titles.")
 
-    final_filtered_games_dict = {}; matched_web_titles_with_selected_games = set()
+    filtered_games = []; selected_game_names = set(); web_title_matched = np.zeros(len(web_title_list), dtype=bool) # Per web title column: a game was kept for it
     logging.info("--- Selecting Best Matches (Stage 2) ---")
     logging.info("Selecting best automatic match for each recommended title (using TokenSortRatio as tie-breaker)...")
     web_title_iterator_stage2 = tqdm(matches_per_web_title.items(), desc="Selecting Best", unit=" web title", ncols=100, leave=False)
-    for recommended_title, potential_matches in web_title_iterator_stage2:
-        logging.debug(f"Processing Web '{recommended_title}', potential DAT matches: { [(s_wr, s_tsr, e.get('name')) for s_wr, s_tsr, e in potential_matches] }")
+    for web_col, potential_matches in web_title_iterator_stage2:
+        recommended_title = web_title_list[web_col]
+        if debug_logging: logging.debug(f"Processing Web '{recommended_title}', potential DAT matches: { [(s_wr, s_tsr, original_names[i]) for s_wr, s_tsr, i in potential_matches] }")
         if not potential_matches: continue
-        sorted_matches = sorted(potential_matches, key=lambda item: (item[0], item[1]), reverse=True)
-        logging.debug(f" -> Sorted potential matches (WR%, TSR%): { [(s_wr, s_tsr, e.get('name')) for s_wr, s_tsr, e in sorted_matches] }")
-        best_match_wratio_score, best_match_tokensort_score, best_match_element = sorted_matches[0]
-        best_match_name = best_match_element.get('name')
-        logging.debug(f" -> Best match for Web '{recommended_title}' is DAT '{best_match_name}' (WR Score: {best_match_wratio_score}%, TSR Score: {best_match_tokensort_score}%)")
-        games_to_keep_for_this_web_title = set([best_match_element])
-        if is_disc_1_regex.search(best_match_name):
-            logging.debug(f" -> '{best_match_name}' looks like Disc 1. Checking for other discs...")
-            best_match_base = get_name_without_disc_info(best_match_name)
-            logging.debug(f"    Base name for multi-disc check: '{best_match_base}'")
-            for other_wratio_score, other_tokensort_score, other_element in sorted_matches[1:]:
-                 if other_wratio_score < similarity_threshold: continue
-                 other_name = other_element.get('name')
-                 if is_disc_n_regex.search(other_name):
-                     other_base = get_name_without_disc_info(other_name)
-                     logging.debug(f"    Comparing base '{other_base}' from '{other_name}' (WR Score: {other_wratio_score}%)")
-                     if best_match_base == other_base:
-                         games_to_keep_for_this_web_title.add(other_element)
-                         logging.debug(f"    -> Also selecting multi-disc match: '{other_name}'")
+        # Only the best entry is needed; max() keeps the first of equal scores, as the previous stable sort did
+        best_match_wratio_score, best_match_tokensort_score, best_match_index = max(potential_matches, key=lambda item: (item[0], item[1]))
+        best_match_name = original_names[best_match_index]
+        if debug_logging: logging.debug(f" -> Best match for Web '{recommended_title}' is DAT '{best_match_name}' (WR Score: {best_match_wratio_score}%, TSR Score: {best_match_tokensort_score}%)")
+        games_to_keep_for_this_web_title = set([best_match_index])
+        best_match_base, best_match_disc = parse_disc(best_match_name)
+        if best_match_disc == 1:
+            logging.debug(" -> '%s' looks like Disc 1. Checking for other discs...", best_match_name)
+            logging.debug("    Base name for multi-disc check: '%s'", best_match_base)
+            disc_matches_by_base = {}
+            for other_wratio_score, other_tokensort_score, other_index in potential_matches:
+                 if other_index == best_match_index or other_wratio_score < similarity_threshold: continue
+                 other_base, other_disc = parse_disc(original_names[other_index])
+                 if other_disc is not None: disc_matches_by_base.setdefault(other_base, []).append((other_wratio_score, other_index))
+            for other_wratio_score, other_index in disc_matches_by_base.get(best_match_base, []):
+                 games_to_keep_for_this_web_title.add(other_index)
+                 logging.debug("    -> Also selecting multi-disc match: '%s' (WR Score: %d%%)", original_names[other_index], other_wratio_score)
         added_new_for_web_title = False
-        for game_element_to_keep in games_to_keep_for_this_web_title:
-             game_name = game_element_to_keep.get('name')
-             if game_name not in final_filtered_games_dict:
-                 final_filtered_games_dict[game_name] = game_element_to_keep; logging.debug(f" -> Added DAT game '{game_name}' to final list (Stage 2)."); added_new_for_web_title = True
-             else: logging.debug(f" -> DAT game '{game_name}' was already added to final list."); added_new_for_web_title = True
+        for game_index_to_keep in games_to_keep_for_this_web_title:
+             game_name = original_names[game_index_to_keep]
+             if game_name not in selected_game_names:
+                 selected_game_names.add(game_name); filtered_games.append(game_index_to_keep); logging.debug(" -> Added DAT game '%s' to final list (Stage 2).", game_name); added_new_for_web_title = True
+             else: logging.debug(" -> DAT game '%s' was already added to final list.", game_name); added_new_for_web_title = True
         if added_new_for_web_title:
-             matched_web_titles_with_selected_games.add(recommended_title); logging.debug(f" -> Marked Web '{recommended_title}' as having selected game(s) (Stage 2).")
-    logging.info(f"Completed initial best match selection. Found {len(final_filtered_games_dict)} preliminary games.")
+             web_title_matched[web_col] = True; logging.debug(" -> Marked Web '%s' as having selected game(s) (Stage 2).", recommended_title)
+    logging.info(f"Completed initial best match selection. Found {len(filtered_games)} preliminary games.")
 
     if args.interactive_review:
         logging.info("--- Starting Interactive Review Stage ---")
-        web_titles_to_review = all_recommended_titles - matched_web_titles_with_selected_games
+        web_titles_to_review = {web_title_list[col] for col in np.flatnonzero(~web_title_matched)}
         logging.info(f"Found {len(web_titles_to_review)} web titles without an automatic match to potentially review.")
         if not web_titles_to_review:
              logging.info("No web titles require interactive review.")
         else:
-            all_game_elements_set = set(all_game_elements)
-            kept_game_elements_set = set(final_filtered_games_dict.values())
-            discarded_game_elements = all_game_elements_set - kept_game_elements_set
-            logging.info(f"Will compare against {len(discarded_game_elements)} discarded DAT games.")
+            kept_game_mask = np.zeros(original_game_count, dtype=bool); kept_game_mask[filtered_games] = True
+            discarded_row_mask = ~kept_game_mask[dat_rows]
+            web_title_columns = {title: col for col, title in enumerate(web_title_list)}
+            logging.info(f"Will compare against {int(discarded_row_mask.sum())} discarded DAT games.")
             titles_reviewed = 0; titles_manually_matched = 0
             interactive_iterator = tqdm(sorted(list(web_titles_to_review)), desc="Interactive Review", unit=" web title", ncols=100, leave=False)
             for web_title in interactive_iterator:
-                 interactive_iterator.set_description(f"Reviewing '{web_title[:30]}...'"); logging.debug(f"Interactively reviewing Web '{web_title}'")
-                 candidates = []
-                 logging.debug(f"  Comparing '{web_title}' against {len(discarded_game_elements)} discarded games...")
-                 for game_element in discarded_game_elements:
-                     cleaned_dat_title = cleaned_dat_titles_map.get(game_element)
-                     dat_title_original = game_element.get('name')
-                     if not dat_title_original or not cleaned_dat_title: continue
-                     try:
-                         wratio_similarity = fuzz.WRatio(cleaned_dat_title, web_title)
-                         if wratio_similarity >= INTERACTIVE_LOW_THRESHOLD:
-                             tokensort_similarity = fuzz.token_sort_ratio(cleaned_dat_title, web_title)
-                             logging.debug(f"    Checking Candidate: DAT='{dat_title_original}', WRatio={wratio_similarity}%, TokenSortRatio={tokensort_similarity}%")
-                             if tokensort_similarity >= INTERACTIVE_LOW_THRESHOLD:
-                                 logging.debug(f"      -> Candidate PASSED TokenSortRatio threshold ({tokensort_similarity}% >= {INTERACTIVE_LOW_THRESHOLD}%)")
-                                 match_tuple = (wratio_similarity, game_element)
-                                 candidates.append(match_tuple)
-                     except Exception as fuzz_error:
-                          logging.error(f"Error during interactive fuzzy comparison for DAT:'{cleaned_dat_title}' and WEB:'{web_title}': {fuzz_error}")
+                 interactive_iterator.set_description(f"Reviewing '{web_title[:30]}...'"); logging.debug("Interactively reviewing Web '%s'", web_title)
+                 candidates = []; web_col = web_title_columns[web_title]
+                 logging.debug("  Looking up Stage 1 scores of '%s' for discarded games...", web_title)
+                 # WRatio comes straight from the Stage 1 matrix; TokenSortRatio is only computed for rows that pass it
+                 column_scores = unique_scores[:, web_col][unique_index_of_row]
+                 candidate_rows = np.flatnonzero((column_scores >= INTERACTIVE_LOW_THRESHOLD) & discarded_row_mask)
+                 # Rounded half-to-even like round() in Stage 1 (uint8 cdist output would round x.5 up), so both stages report the same TSR
+                 candidate_tokensort_scores = np.rint(process.cdist([token_sorted_web_titles[web_col]], [token_sorted_dat_titles[dat_rows[row]] for row in candidate_rows], scorer=fuzz.ratio, dtype=np.float64, workers=-1)[0])
+                 for row, tokensort_similarity in zip(candidate_rows, candidate_tokensort_scores):
+                     game_index = dat_rows[row]; wratio_similarity = int(column_scores[row]); tokensort_similarity = int(tokensort_similarity)
+                     if debug_logging: logging.debug(f"    Checking Candidate: DAT='{original_names[game_index]}', WRatio={wratio_similarity}%, TokenSortRatio={tokensort_similarity}%")
+                     if tokensort_similarity >= INTERACTIVE_LOW_THRESHOLD:
+                         if debug_logging: logging.debug(f"      -> Candidate PASSED TokenSortRatio threshold ({tokensort_similarity}% >= {INTERACTIVE_LOW_THRESHOLD}%)")
+                         match_tuple = (wratio_similarity, game_index)
+                         candidates.append(match_tuple)
 
                  if not candidates:
                      logging.info(f"No suitable candidates found for '{web_title}' passing BOTH thresholds >= {INTERACTIVE_LOW_THRESHOLD}%. Skipping review.")
@@ -247,8 +451,8 @@ def filter_dat_file(input_dat_path, output_dat_path, all_recommended_titles, tit
                  # *** CORRECTED THIS LINE ***
                  print(Style.DIM + f"(No automatic match >= {similarity_threshold}% was selected)" + Style.RESET_ALL)
                  print(f"Potential Filtered DAT candidates (WRatio & TokenSortRatio >= {INTERACTIVE_LOW_THRESHOLD}%):")
-                 for i, (score, element) in enumerate(sorted_candidates):
-                     print(Fore.CYAN + f"  [{i+1}] " + Fore.RESET + f"{element.get('name')} (Score: {score}%)")
+                 for i, (score, game_index) in enumerate(sorted_candidates):
+                     print(Fore.CYAN + f"  [{i+1}] " + Fore.RESET + f"{original_names[game_index]} (Score: {score}%)")
                  print(Fore.GREEN + f"  [0 or N] " + Fore.RESET + f"None of these - Keep '{web_title}' as unmatched.")
 
                  # Input loop
@@ -267,53 +471,69 @@ def filter_dat_file(input_dat_path, output_dat_path, all_recommended_titles, tit
 
                  # Process valid selection WITH automatic multi-disc handling
                  if selected_index != -1:
-                     score_chosen, element_chosen = sorted_candidates[selected_index]
-                     name_chosen = element_chosen.get('name')
+                     score_chosen, index_chosen = sorted_candidates[selected_index]
+                     name_chosen = original_names[index_chosen]
                      logging.info(f"User selected: '{name_chosen}' (Score: {score_chosen}%) for Web Title '{web_title}'.")
-                     elements_to_add_this_round = {element_chosen}
-                     if is_disc_1_regex.search(name_chosen):
-                         logging.debug(f" -> Selected item '{name_chosen}' looks like Disc 1. Checking candidate list for other discs...")
-                         base_name_chosen = get_name_without_disc_info(name_chosen)
-                         logging.debug(f"    Base name for multi-disc check: '{base_name_chosen}'")
-                         for other_score, other_element in sorted_candidates: # Check same list shown
-                             if other_element is element_chosen: continue
-                             other_name = other_element.get('name')
-                             if is_disc_n_regex.search(other_name):
-                                 other_base = get_name_without_disc_info(other_name)
+                     indices_to_add_this_round = {index_chosen}
+                     base_name_chosen, disc_chosen = parse_disc(name_chosen)
+                     if disc_chosen == 1:
+                         logging.debug(" -> Selected item '%s' looks like Disc 1. Checking candidate list for other discs...", name_chosen)
+                         logging.debug("    Base name for multi-disc check: '%s'", base_name_chosen)
+                         for other_score, other_index in sorted_candidates: # Check same list shown
+                             if other_index == index_chosen: continue
+                             other_name = original_names[other_index]
+                             other_base, other_disc = parse_disc(other_name)
+                             if other_disc is not None:
                                  if other_base == base_name_chosen:
                                      logging.info(f"    -> Automatically adding multi-disc match: '{other_name}' (Score: {other_score}%)")
-                                     elements_to_add_this_round.add(other_element)
+                                     indices_to_add_this_round.add(other_index)
                                  # else: logging.debug(f"    -> Skipping '{other_name}', base name mismatch...") # Noise removed
-                     # Add all selected elements
-                     for element_to_add in elements_to_add_this_round:
-                         game_name_to_add = element_to_add.get('name')
-                         if game_name_to_add not in final_filtered_games_dict:
-                             final_filtered_games_dict[game_name_to_add] = element_to_add; logging.debug(f" -> Added '{game_name_to_add}' to final list (Stage 3).")
-                         else: logging.debug(f" -> '{game_name_to_add}' was already in the final list.")
-                     matched_web_titles_with_selected_games.add(web_title); titles_manually_matched += 1
+                     # Add all selected games
+                     for index_to_add in indices_to_add_this_round:
+                         game_name_to_add = original_names[index_to_add]
+                         if game_name_to_add not in selected_game_names:
+                             selected_game_names.add(game_name_to_add); filtered_games.append(index_to_add); logging.debug(" -> Added '%s' to final list (Stage 3).", game_name_to_add)
+                         else: logging.debug(" -> '%s' was already in the final list.", game_name_to_add)
+                     web_title_matched[web_col] = True; titles_manually_matched += 1
             logging.info(f"--- Interactive Review Complete ({titles_reviewed} reviewed, {titles_manually_matched} manually matched) ---")
 
     # Recalculate final counts
-    filtered_games = list(final_filtered_games_dict.values()); total_matched_dat_games = len(filtered_games)
+    total_matched_dat_games = len(filtered_games)
     total_unmatched_dat_games = original_game_count - total_matched_dat_games
-    global_unmatched_recommended_titles = all_recommended_titles - matched_web_titles_with_selected_games
+    global_unmatched_recommended_titles = {web_title_list[col] for col in np.flatnonzero(~web_title_matched)}
     logging.info(f"Final selected game count: {total_matched_dat_games}")
 
     # Write DAT File
     logging.info("--- Writing Output Files ---")
-    new_root = ET.Element('datafile'); new_root.append(new_header);
-    for game in filtered_games: new_root.append(game)
-    new_tree = ET.ElementTree(new_root); logging.info(f"Writing filtered DAT file to: {output_dat_path}")
+    logging.info(f"Writing filtered DAT file to: {output_dat_path}")
+    selected_game_indices = set(filtered_games)
     reread_count = -1
     try:
-        ET.indent(new_tree, space="\t", level=0)
-        with open(output_dat_path, 'w', encoding='utf-8') as f: new_tree.write(f, encoding='unicode', xml_declaration=True, short_empty_elements=True)
+        # Second streaming pass over the input: selected games are written out as they are reached (DAT order)
+        with open(output_dat_path, 'wb', buffering=DAT_OUTPUT_BUFFER_SIZE) as output_file, ET.xmlfile(output_file, encoding='utf-8') as xf:
+            xf.write_declaration()
+            if input_doctype: xf.write_doctype(input_doctype)
+            with xf.element('datafile'):
+                element_separator = "\n\t" if args.pretty else "\n" # Compact output: one element per line, no indent pass over each game
+                if args.pretty: ET.indent(new_header, space="\t", level=1)
+                xf.write(element_separator); xf.write(new_header)
+                game_index = 0
+                for game in iter_dat_games(input_dat_path):
+                    if game_index in selected_game_indices:
+                        if args.pretty: ET.indent(game, space="\t", level=1)
+                        xf.write(element_separator); xf.write(game)
+                    game_index += 1
+                xf.write("\n")
         logging.debug(f"Successfully wrote filtered DAT to {output_dat_path}")
         logging.info("Confirming entry count in output file...")
         try:
-            reread_tree = ET.parse(output_dat_path); reread_root = reread_tree.getroot()
-            if reread_root.tag != 'datafile': logging.error(f"Re-read validation failed...")
-            else: reread_games = reread_root.findall('.//game'); reread_count = len(reread_games); logging.debug(f"Re-read successful. Found {reread_count} <game> elements.")
+            # Streamed count: the output is parsed once more, but never held as a tree
+            reread_game_count = 0; reread_root_tag = None
+            for element in iter_dat_games(output_dat_path, tags=('datafile', 'game')):
+                if element.tag == 'game': reread_game_count += 1
+                if reread_root_tag is None: reread_root_tag = element.getroottree().getroot().tag
+            if reread_root_tag != 'datafile': logging.error(f"Re-read validation failed...")
+            else: reread_count = reread_game_count; logging.debug(f"Re-read successful. Found {reread_count} <game> elements.")
         except ET.ParseError as parse_err: logging.error(f"Failed to re-parse output file...: {parse_err}")
         except IOError as io_err: logging.error(f"Failed to re-open output file...: {io_err}")
         except Exception as reread_err: logging.exception("Unexpected error during output file count confirmation:")
@@ -328,19 +548,19 @@ def filter_dat_file(input_dat_path, output_dat_path, all_recommended_titles, tit
             if titles_from_this_url is None: continue
             url_counter += 1
             unmatched_for_this_url = titles_from_this_url.intersection(global_unmatched_recommended_titles)
-            logging.debug(f"URL: {url} - Found {len(titles_from_this_url)} titles, {len(unmatched_for_this_url)} are still unmatched.")
+            logging.debug("URL: %s - Found %d titles, %d are still unmatched.", url, len(titles_from_this_url), len(unmatched_for_this_url))
             if unmatched_for_this_url:
                 try:
                     url_path = urllib.parse.urlparse(url).path; path_parts = [part for part in url_path.strip('/').split('/') if part and part.lower() != 'wiki']
                     if path_parts: base_name_url = '_'.join(path_parts)
                     else: base_name_url = f'url_{url_counter}'
-                    sanitized_name = re.sub(r'[^\w.-]+', '_', base_name_url).strip('_');
+                    sanitized_name = unsafe_filename_chars_regex.sub('_', base_name_url).strip('_');
                     if not sanitized_name: sanitized_name = f"url_{url_counter}"
                     csv_filename = f"{sanitized_name}_unmatched.csv"; full_csv_path = os.path.join(output_dir, csv_filename)
                     logging.info(f"Writing CSV for final unmatched titles from {url} -> '{csv_filename}' ({len(unmatched_for_this_url)} titles)...")
-                    with open(full_csv_path, 'w', newline='', encoding='utf-8') as csvfile:
+                    with open(full_csv_path, 'w', newline='', encoding='utf-8', buffering=CSV_BUFFER_SIZE) as csvfile:
                         writer = csv.writer(csvfile); writer.writerow([f'Unmatched Recommended Title from {url} (After Review/No Match Kept)'])
-                        for title in sorted(list(unmatched_for_this_url)): writer.writerow([title])
+                        writer.writerows([title] for title in sorted(unmatched_for_this_url))
                     csv_files_created.append(csv_filename)
                 except Exception as e: logging.exception(f"Error creating/writing CSV for {url} to {full_csv_path}:")
     # Final CSV Summary Message
@@ -370,7 +590,7 @@ def filter_dat_file(input_dat_path, output_dat_path, all_recommended_titles, tit
     logging.info(f"{'- Matching Games Kept:':<30} {total_matched_dat_games:>7} (After selection & review)")
     logging.info(f"{'- Games Removed/Not Selected:':<30} {total_unmatched_dat_games:>7}")
     logging.info("Web Titles vs DAT Comparison:")
-    logging.info(f"{'- Web Titles Matched (Game Kept):':<30} {len(matched_web_titles_with_selected_games):>7}")
+    logging.info(f"{'- Web Titles Matched (Game Kept):':<30} {int(web_title_matched.sum()):>7}")
     logging.info(f"{'- Web Titles NOT Matched (No Game Kept):':<30} {len(global_unmatched_recommended_titles):>7}")
     logging.info("--------------------------------")
     # Confirmation Count Output
@@ -395,6 +615,12 @@ if __name__ == "__main__":
     parser.add_argument("-t", "--threshold", type=int, default=90, choices=range(0, 101), metavar="[0-100]", help="Similarity threshold (0-100) for automatic matching stage (using WRatio). Default: 90.")
     parser.add_argument("--check-homebrew", "-hb", action='store_true', help="Automatically check for and include '/Homebrew' suffixed URLs based on provided URLs.")
     parser.add_argument("--check-japan", "-j", action='store_true', help="Automatically check for and include '/Japan' suffixed URLs based on provided URLs.")
+    parser.add_argument("--fast-match", action='store_true', help="Credit each DAT game only to its highest-scoring web title instead of every web title it matches. A web title whose games all match another title better stays unmatched (and is reported in the unmatched CSVs).")
+    parser.add_argument("--pretty", action='store_true', help="Indent the output DAT with tabs. By default each <game> is written on a single line.")
+    parser.add_argument("--fetch-concurrency", type=int, default=MAX_FETCH_WORKERS, metavar="N", help="Maximum number of URLs downloaded in parallel.")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, metavar="DIR", help=f"Directory for the on-disk cache of fetched titles. Default: {DEFAULT_CACHE_DIR}.")
+    parser.add_argument("--no-cache", action='store_true', help="Do not read or write the on-disk cache of fetched titles.")
+    parser.add_argument("--refresh-cache", action='store_true', help="Download every URL in full, ignoring cached copies, and update the cache.")
     parser.add_argument( "--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"], help="Set the logging level for console output.")
     parser.add_argument( "--log-file", default=None, help="Path to an optional file to write logs to (all levels DEBUG and above).")
     parser.add_argument("-v", "--version", action="version", version=f"%(prog)s {SCRIPT_VERSION}")
@@ -402,63 +628,69 @@ if __name__ == "__main__":
     try: args = parser.parse_args()
     except SystemExit as e: sys.exit(e.code)
     except Exception as e: print(f"CRITICAL ERROR during argument parsing: {e}", file=sys.stderr); sys.exit(1)
+    if args.fetch_concurrency < 1: parser.error("--fetch-concurrency must be at least 1")
 
     log_level_console = getattr(logging, args.log_level.upper(), logging.INFO); console_log_format = '%(levelname)s: %(message)s'; file_log_format = '%(asctime)s - %(levelname)s - %(message)s'
     logger = logging.getLogger(); logger.setLevel(logging.DEBUG);
     if logger.hasHandlers(): logger.handlers.clear()
-    level_styles = coloredlogs.DEFAULT_LEVEL_STYLES; level_styles['info']['color'] = 'cyan'; level_styles['debug']['color'] = 'magenta'
-    field_styles = coloredlogs.DEFAULT_FIELD_STYLES; field_styles['levelname']['bold'] = True
-    coloredlogs.install(level=log_level_console, logger=logger, fmt=console_log_format, stream=sys.stderr, level_styles=level_styles, field_styles=field_styles)
+    if sys.stderr.isatty():
+        import coloredlogs
+        level_styles = coloredlogs.DEFAULT_LEVEL_STYLES; level_styles['info']['color'] = 'cyan'; level_styles['debug']['color'] = 'magenta'
+        field_styles = coloredlogs.DEFAULT_FIELD_STYLES; field_styles['levelname']['bold'] = True
+        coloredlogs.install(level=log_level_console, logger=logger, fmt=console_log_format, stream=sys.stderr, level_styles=level_styles, field_styles=field_styles)
+    else: # Redirected/piped: plain records, no ANSI escapes to build or strip
+        console_handler = logging.StreamHandler(sys.stderr); console_handler.setLevel(log_level_console)
+        console_handler.setFormatter(logging.Formatter(console_log_format)); logger.addHandler(console_handler)
     if args.log_file:
         try:
-            log_dir = os.path.dirname(args.log_file);
-            if log_dir and not os.path.exists(log_dir): os.makedirs(log_dir); logging.info(f"Created directory for log file: {log_dir}")
-            file_handler = logging.FileHandler(args.log_file, mode='w', encoding='utf-8'); file_handler.setLevel(logging.DEBUG)
-            file_handler.setFormatter(logging.Formatter(file_log_format)); logger.addHandler(file_handler)
+            log_dir = pathlib.Path(args.log_file).parent
+            if not log_dir.is_dir(): log_dir.mkdir(parents=True, exist_ok=True); logging.info(f"Created directory for log file: {log_dir}")
+            file_handler = BufferedFileHandler(args.log_file, mode='w', encoding='utf-8'); file_handler.setLevel(logging.DEBUG)
+            file_handler.setFormatter(logging.Formatter(file_log_format))
+            # File writes happen on a listener thread; the console handler stays synchronous so it keeps in step with tqdm bars and prompts
+            log_queue = queue.Queue(-1); queue_handler = QueueHandler(log_queue); queue_handler.setLevel(logging.DEBUG); logger.addHandler(queue_handler)
+            log_listener = QueueListener(log_queue, file_handler, respect_handler_level=True); log_listener.start(); atexit.register(log_listener.stop)
             logging.info(f"Logging detailed output (DEBUG level and above) to: {args.log_file}")
         except IOError as e: logging.error(f"Could not open log file {args.log_file} for writing: {e}", exc_info=False)
         except OSError as e: logging.error(f"Could not create directory for log file {args.log_file}: {e}", exc_info=False)
+    logger.setLevel(min(handler.level for handler in logger.handlers)) # Lets isEnabledFor(DEBUG) skip debug formatting when no handler shows it
 
-    user_urls = args.urls; expanded_urls = set(user_urls); logging.debug(f"Initial URLs provided: {user_urls}")
-    if args.check_homebrew:
-        logging.info("Checking for '/Homebrew' URL variants...")
-        homebrew_variants = set();
-        for base_url in user_urls:
-            if not base_url.lower().rstrip('/').endswith('/homebrew'): hb_url = base_url.rstrip('/') + "/Homebrew"; homebrew_variants.add(hb_url); logging.debug(f" Adding Homebrew variant: {hb_url}")
-        expanded_urls.update(homebrew_variants)
-    if args.check_japan:
-        logging.info("Checking for '/Japan' URL variants...")
-        japan_variants = set();
+    user_urls = args.urls; expanded_urls = dict.fromkeys(user_urls); logging.debug(f"Initial URLs provided: {user_urls}")
+    variant_suffixes = [suffix for suffix, enabled in (("Homebrew", args.check_homebrew), ("Japan", args.check_japan)) if enabled]
+    for suffix in variant_suffixes: logging.info(f"Checking for '/{suffix}' URL variants...")
+    if variant_suffixes:
         for base_url in user_urls:
-            if not base_url.lower().rstrip('/').endswith('/japan'): jp_url = base_url.rstrip('/') + "/Japan"; japan_variants.add(jp_url); logging.debug(f" Adding Japan variant: {jp_url}")
-        expanded_urls.update(japan_variants)
-    final_urls_to_fetch = sorted(list(expanded_urls))
+            stripped_url = base_url.rstrip('/'); suffix_match = url_variant_suffix_regex.search(stripped_url); existing_suffix = suffix_match.group(1).lower() if suffix_match else None
+            for suffix in variant_suffixes:
+                if existing_suffix != suffix.lower(): variant_url = f"{stripped_url}/{suffix}"; expanded_urls[variant_url] = None; logging.debug(" Adding %s variant: %s", suffix, variant_url)
+    final_urls_to_fetch = list(expanded_urls) # Command-line order, then the variants: stable logs and per-URL reports without sorting
     if len(final_urls_to_fetch) > len(user_urls):
         logging.info(f"Final list includes expanded URLs ({len(final_urls_to_fetch)} total):");
-        for u in final_urls_to_fetch: logging.debug(f"  - {u}")
+        if logger.isEnabledFor(logging.DEBUG):
+            for u in final_urls_to_fetch: logging.debug("  - %s", u)
     else: logging.info(f"Processing only the provided URLs ({len(final_urls_to_fetch)} total).")
 
     try:
         input_path = args.input_file
-        if not os.path.isfile(input_path): logging.critical(f"Specified input path is not a file or does not exist: {input_path}"); sys.exit(1)
-        input_dir = os.path.dirname(os.path.abspath(input_path)); base_name, _ = os.path.splitext(os.path.basename(input_path))
+        input_file = pathlib.Path(os.path.abspath(input_path)) # abspath rather than resolve(): a symlinked DAT keeps its output next to the link
+        if not input_file.is_file(): logging.critical(f"Specified input path is not a file or does not exist: {input_path}"); sys.exit(1)
         if args.output_file:
-            output_dat_path = args.output_file
-            output_dir_specified = os.path.dirname(os.path.abspath(output_dat_path))
-            if output_dir_specified and not os.path.exists(output_dir_specified):
-                 try: os.makedirs(output_dir_specified); logging.info(f"Created output directory: {output_dir_specified}")
-                 except OSError as e: logging.critical(f"Could not create output directory '{output_dir_specified}': {e}"); sys.exit(1)
-        else: output_dat_path = os.path.join(input_dir, f"{base_name}_filtered.dat")
-        output_dat_path = os.path.abspath(output_dat_path)
+            output_file = pathlib.Path(os.path.abspath(args.output_file))
+            if not output_file.parent.is_dir():
+                 try: output_file.parent.mkdir(parents=True, exist_ok=True); logging.info(f"Created output directory: {output_file.parent}")
+                 except OSError as e: logging.critical(f"Could not create output directory '{output_file.parent}': {e}"); sys.exit(1)
+        else: output_file = input_file.with_name(f"{input_file.stem}_filtered.dat")
+        output_dat_path = str(output_file)
     except Exception as e: logging.critical(f"Error during path determination: {e}", exc_info=True); sys.exit(1)
 
     logging.info("--- Initial Configuration ---")
-    logging.info(f"Input File:                {os.path.abspath(input_path)}")
+    logging.info(f"Input File:                {input_file}")
     logging.info(f"Output DAT File (planned): {output_dat_path}")
     logging.info(f"Similarity Threshold:      {args.threshold}% (WRatio+TSR)")
+    logging.info(f"Web Title Cache:           {'Disabled' if args.no_cache else args.cache_dir + (' (refreshing)' if args.refresh_cache else '')}")
     if args.interactive_review: logging.info(f"Interactive Review:        Enabled (Low Threshold: {INTERACTIVE_LOW_THRESHOLD}% for WRatio & TokenSortRatio)")
 
-    all_titles, titles_by_url = fetch_all_titles(final_urls_to_fetch)
+    all_titles, titles_by_url = fetch_all_titles(final_urls_to_fetch, args.fetch_concurrency, None if args.no_cache else args.cache_dir, args.refresh_cache)
     if all_titles is not None:
         try:
             success = filter_dat_file( input_path, output_dat_path, all_titles, titles_by_url, args.threshold, args )
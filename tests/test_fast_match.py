@@ -0,0 +1,33 @@
+import sys, types, logging
+from pathlib import Path
+from lxml import etree as ET
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import filter_script
+
+def run_filter(tmp_path, game_names, web_titles, fast_match):
+    """Runs filter_dat_file on a DAT made of game_names and returns the names of the games kept."""
+    input_dat = tmp_path / "in.dat"; output_dat = tmp_path / "out.dat"
+    input_dat.write_text("<datafile><header><name>Test</name></header>" + "".join(f'<game name="{name}"/>' for name in game_names) + "</datafile>", encoding="utf-8")
+    args = types.SimpleNamespace(interactive_review=False, fast_match=fast_match, pretty=False)
+    logging.disable(logging.CRITICAL)
+    try: assert filter_script.filter_dat_file(str(input_dat), str(output_dat), set(web_titles), {"url": set(web_titles)}, 90, args)
+    finally: logging.disable(logging.NOTSET)
+    return [game.get('name') for game in ET.parse(str(output_dat)).getroot().iter('game')]
+
+def test_fast_match_sees_exact_match_columns(tmp_path):
+    # 'super marios' scores 96 against the exact-match title 'super mario' and 95 against 'super marios x',
+    # so with --fast-match it is credited to 'super mario', where the exact match wins
+    games = ["Super Mario (USA)", "Super Marios (USA)"]; web_titles = ["super mario", "super marios x"]
+    assert run_filter(tmp_path, games, web_titles, fast_match=True) == ["Super Mario (USA)"]
+    assert run_filter(tmp_path, games, web_titles, fast_match=False) == ["Super Mario (USA)", "Super Marios (USA)"]
+
+def test_fast_match_breaks_ties_by_token_sort_then_title(tmp_path):
+    # 'mario kart' has the same WRatio against both titles, and the same TokenSortRatio too,
+    # so the alphabetically first title gets the game and the other one is reported unmatched
+    assert run_filter(tmp_path, ["Mario Kart (USA)"], ["mario kart world", "mario kart super"], fast_match=True) == ["Mario Kart (USA)"]
+    assert "mario kart world" in (tmp_path / "url_unmatched.csv").read_text(encoding="utf-8")
+    assert "mario kart super" not in (tmp_path / "url_unmatched.csv").read_text(encoding="utf-8")
+
+def test_fast_match_without_web_titles(tmp_path):
+    assert run_filter(tmp_path, ["Super Mario (USA)"], [], fast_match=True) == []